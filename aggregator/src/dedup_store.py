@@ -1,80 +1,303 @@
+import atexit
+import heapq
+import logging
+import math
+import mmap
+import os
 import sqlite3
 import threading
-from typing import Optional, List, Tuple
+from contextlib import contextmanager
+import numpy as np
+import xxhash
+from itertools import chain, islice
+from operator import itemgetter
+from typing import Dict, Iterator, Optional, List, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore[assignment]
+
+logger = logging.getLogger('dedup_store')
+
+INSERT_OR_IGNORE = 'INSERT OR IGNORE INTO processed(topic,event_id,timestamp,source,payload) VALUES (?,?,?,?,?)'
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float, path: Optional[str] = None):
+        bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.size = max(64, (bits + 63) // 64 * 64)
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self._steps = np.arange(self.hash_count, dtype=np.uint64)
+        self._fd = None
+        if path is None:
+            self._bits = np.zeros(self.size // 64, dtype=np.uint64)
+        else:
+            # File-backed bits are shared by every process mapping the same path.
+            nbytes = self.size // 8
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            with self._locked():
+                if os.fstat(self._fd).st_size != nbytes:
+                    os.ftruncate(self._fd, 0)
+                    os.ftruncate(self._fd, nbytes)
+            self._mmap = mmap.mmap(self._fd, nbytes)
+            self._bits = np.frombuffer(self._mmap, dtype=np.uint64)
+
+    @contextmanager
+    def _locked(self):
+        if self._fd is None or fcntl is None:
+            yield
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _positions(self, keys: List[str]) -> np.ndarray:
+        # Double hashing (h1 + i*h2) over the two halves of each key's 128-bit digest,
+        # computed for the whole batch at once: one row of k bit positions per key.
+        digests = np.frombuffer(b''.join(xxhash.xxh3_128_digest(k.encode()) for k in keys), dtype=np.uint64)
+        h1 = digests[0::2, None]
+        h2 = digests[1::2, None] | np.uint64(1)
+        return (h1 + self._steps * h2) % np.uint64(self.size)
+
+    def add_many(self, keys: List[str]):
+        if not keys:
+            return
+        pos = self._positions(keys).ravel()
+        with self._locked():
+            np.bitwise_or.at(self._bits, pos >> np.uint64(6), np.uint64(1) << (pos & np.uint64(63)))
+
+    def contains_many(self, keys: List[str]) -> List[bool]:
+        if not keys:
+            return []
+        pos = self._positions(keys)
+        hits = (self._bits[pos >> np.uint64(6)] >> (pos & np.uint64(63))) & np.uint64(1)
+        return hits.all(axis=1).tolist()
+
+    def add(self, key: str):
+        self.add_many([key])
+
+    def maybe_contains(self, key: str) -> bool:
+        return self.contains_many([key])[0]
+
+def _bloom_key(topic: str, event_id: str) -> str:
+    return topic + '\0' + event_id
+
+def _has_rows(path: str) -> bool:
+    conn = sqlite3.connect(path)
+    try:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='processed'").fetchone() is None:
+            return False
+        return conn.execute('SELECT 1 FROM processed LIMIT 1').fetchone() is not None
+    finally:
+        conn.close()
 
 class DedupStore:
-    def __init__(self, db_path: str = './data.db'):
+    def __init__(self, db_path: str = './data.db', shards: int = 1, bloom_capacity: int = 1_000_000, bloom_error_rate: float = 1e-6,
+                 bloom_path: Optional[str] = None):
         self.db_path = db_path
+        # A shared Bloom file means other processes write to the same database.
+        self.shared = bloom_path is not None
+        if shards > 1:
+            root, ext = os.path.splitext(db_path)
+            self.shard_paths = [f'{root}.{i}{ext}' for i in range(shards)]
+        else:
+            self.shard_paths = [db_path]
         self._ddl_lock = threading.Lock()
+        self._tls = threading.local()
+        self._all_conns: List[sqlite3.Connection] = []
+        self._check_layout()
         self._ensure_tables()
+        self._bloom = BloomFilter(bloom_capacity, bloom_error_rate, bloom_path)
+        self._topics: Set[str] = set()
+        self._load_existing()
+
+    def _shard(self, topic: str) -> int:
+        if len(self.shard_paths) == 1:
+            return 0
+        return xxhash.xxh3_64_intdigest(topic.encode()) % len(self.shard_paths)
 
-    def _conn(self):
+    def _connect(self, shard: int = 0) -> sqlite3.Connection:
         conn = sqlite3.connect(
-            self.db_path, 
+            self.shard_paths[shard], 
             check_same_thread=False,
-            timeout=30.0 
+            timeout=30.0,
+            isolation_level=None
         )
         conn.row_factory = sqlite3.Row
         conn.execute('PRAGMA journal_mode=WAL')
         conn.execute('PRAGMA busy_timeout=30000')
+        # With WAL, NORMAL only fsyncs at checkpoints: a power loss or OS crash can drop the
+        # most recent commits, but a crash of this process cannot.
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-65536')
+        conn.execute('PRAGMA mmap_size=268435456')
         return conn
 
-    def _ensure_tables(self):
+    def _conn(self, shard: int = 0) -> sqlite3.Connection:
+        conns = getattr(self._tls, 'conns', None)
+        if conns is None:
+            conns = self._tls.conns = {}
+        conn = conns.get(shard)
+        if conn is None:
+            conn = conns[shard] = self._connect(shard)
+            with self._ddl_lock:
+                if not self._all_conns:
+                    atexit.register(self.close)
+                self._all_conns.append(conn)
+        return conn
+
+    def close(self):
         with self._ddl_lock:
-            conn = self._conn()
-            cur = conn.cursor()
-            cur.execute('''
-                CREATE TABLE IF NOT EXISTS processed (
-                    topic TEXT NOT NULL,
-                    event_id TEXT NOT NULL,
-                    timestamp TEXT,
-                    source TEXT,
-                    payload TEXT,
-                    PRIMARY KEY (topic, event_id)
-                )
-            ''')
-            cur.execute('''
-                CREATE INDEX IF NOT EXISTS idx_topic_timestamp 
-                ON processed(topic, timestamp)
-            ''')
-            conn.commit()
+            conns, self._all_conns = self._all_conns, []
+        for conn in conns:
             conn.close()
 
-    def exists(self, topic: str, event_id: str) -> bool:
-        conn = self._conn()
-        try:
-            cur = conn.cursor()
-            cur.execute(
-                'SELECT 1 FROM processed WHERE topic=? AND event_id=? LIMIT 1',
-                (topic, event_id)
-            )
-            result = cur.fetchone() is not None
-            return result
-        finally:
-            conn.close()
+    def _check_layout(self):
+        # Rows written under the other layout would be invisible here and silently re-accepted.
+        root, ext = os.path.splitext(self.db_path)
+        if len(self.shard_paths) > 1:
+            other = self.db_path
+            clash = os.path.exists(other) and _has_rows(other)
+        else:
+            # Shard files only exist if this path was opened sharded before.
+            other = f'{root}.0{ext}'
+            clash = os.path.exists(other)
+        if clash:
+            raise ValueError(f'{other} belongs to a store with a different DEDUP_SHARDS; resharding needs a migration')
+
+    def _ensure_tables(self):
+        for shard in range(len(self.shard_paths)):
+            conn = self._conn(shard)
+            with self._ddl_lock:
+                cur = conn.cursor()
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS processed (
+                        topic TEXT NOT NULL,
+                        event_id TEXT NOT NULL,
+                        timestamp TEXT,
+                        source TEXT,
+                        payload TEXT,
+                        PRIMARY KEY (topic, event_id)
+                    )
+                ''')
+                cur.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_topic_timestamp 
+                    ON processed(topic, timestamp)
+                ''')
+                cur.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+                cur.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('shards', ?)", (str(len(self.shard_paths)),))
+                stored = int(cur.execute("SELECT value FROM meta WHERE key='shards'").fetchone()['value'])
+                if stored != len(self.shard_paths):
+                    raise ValueError(
+                        f'{self.shard_paths[shard]} was created with DEDUP_SHARDS={stored}, not {len(self.shard_paths)}; '
+                        'resharding needs a migration'
+                    )
+
+    def _load_existing(self):
+        for shard in range(len(self.shard_paths)):
+            cur = self._conn(shard).execute('SELECT topic,event_id FROM processed')
+            while True:
+                rows = cur.fetchmany(10000)
+                if not rows:
+                    break
+                self._bloom.add_many([_bloom_key(topic, event_id) for topic, event_id in rows])
+                self._topics.update(topic for topic, _ in rows)
+
+    def exists_many(self, rows: List[Tuple]) -> List[bool]:
+        found = [False] * len(rows)
+        hits = self._bloom.contains_many([_bloom_key(row[0], row[1]) for row in rows])
+        for i, hit in enumerate(hits):
+            if hit:
+                topic, event_id = rows[i][0], rows[i][1]
+                cur = self._conn(self._shard(topic)).execute(
+                    'SELECT 1 FROM processed WHERE topic=? AND event_id=? LIMIT 1',
+                    (topic, event_id)
+                )
+                found[i] = cur.fetchone() is not None
+        return found
 
     def add_if_new(self, topic: str, event_id: str, timestamp: str, source: str, payload_json: str) -> bool:
-        conn = self._conn()
+        conn = self._conn(self._shard(topic))
         try:
             cur = conn.cursor()
-            cur.execute(
-                'INSERT INTO processed(topic,event_id,timestamp,source,payload) VALUES (?,?,?,?,?)',
-                (topic, event_id, timestamp, source, payload_json)
-            )
-            conn.commit()
+            cur.execute(INSERT_OR_IGNORE, (topic, event_id, timestamp, source, payload_json))
+            if cur.rowcount != 1:
+                return False
+            self._bloom.add(_bloom_key(topic, event_id))
+            self._topics.add(topic)
             return True
         except sqlite3.IntegrityError:
             return False
         except Exception as e:
-            import logging
-            logger = logging.getLogger('dedup_store')
             logger.error(f'Database error in add_if_new: {e}')
             return False
-        finally:
-            conn.close()
 
-    def list_by_topic(self, topic: Optional[str] = None) -> List[Tuple]:
-        conn = self._conn()
+    def add_many(self, rows: List[Tuple]) -> List[bool]:
+        inserted = [False] * len(rows)
+        firsts: Dict[str, int] = {}
+        for i, row in enumerate(rows):
+            firsts.setdefault(_bloom_key(row[0], row[1]), i)
+        by_shard: Dict[int, Tuple[List[int], List[int]]] = {}
+        for i, hit in zip(firsts.values(), self._bloom.contains_many(list(firsts))):
+            fresh, maybe = by_shard.setdefault(self._shard(rows[i][0]), ([], []))
+            if hit:
+                maybe.append(i)
+            else:
+                fresh.append(i)
+
+        for shard, (fresh, maybe) in by_shard.items():
+            self._insert_shard(shard, rows, fresh, maybe, inserted)
+
+        new_rows = [row for row, is_new in zip(rows, inserted) if is_new]
+        self._bloom.add_many([_bloom_key(row[0], row[1]) for row in new_rows])
+        self._topics.update(row[0] for row in new_rows)
+        return inserted
+
+    def _insert_shard(self, shard: int, rows: List[Tuple], fresh: List[int], maybe: List[int], inserted: List[bool]):
+        conn = self._conn(shard)
+        try:
+            cur = conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            if fresh:
+                cur.executemany(INSERT_OR_IGNORE, [rows[i] for i in fresh])
+                if cur.rowcount == len(fresh):
+                    for i in fresh:
+                        inserted[i] = True
+                else:
+                    # Another writer got ahead of the filter; redo those rows one by one.
+                    cur.execute('ROLLBACK')
+                    cur.execute('BEGIN IMMEDIATE')
+                    maybe = fresh + maybe
+            for i in maybe:
+                cur.execute(INSERT_OR_IGNORE, rows[i])
+                inserted[i] = cur.rowcount == 1
+            cur.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                cur.execute('ROLLBACK')
+            for i in fresh + maybe:
+                inserted[i] = False
+            logger.error(f'Database error in add_many: {e}')
+
+    def iter_by_topic(self, topic: Optional[str] = None, chunk_size: int = 500) -> Iterator[List[Tuple]]:
+        if topic:
+            return self._iter_shard(self._shard(topic), topic, chunk_size)
+        if len(self.shard_paths) == 1:
+            return self._iter_shard(0, None, chunk_size)
+        # Topics never span shards, so merging on topic alone keeps the (topic, timestamp) order.
+        rows = heapq.merge(
+            *(chain.from_iterable(self._iter_shard(shard, None, chunk_size)) for shard in range(len(self.shard_paths))),
+            key=itemgetter(0)
+        )
+        return iter(lambda: list(islice(rows, chunk_size)), [])
+
+    def _iter_shard(self, shard: int, topic: Optional[str], chunk_size: int) -> Iterator[List[Tuple]]:
+        # Uses its own connection: a streaming response may resume this generator on any thread.
+        conn = self._connect(shard)
+        conn.row_factory = None
         try:
             cur = conn.cursor()
             if topic:
@@ -86,27 +309,25 @@ class DedupStore:
                 cur.execute(
                     'SELECT topic,event_id,timestamp,source,payload FROM processed ORDER BY topic,timestamp'
                 )
-            rows = cur.fetchall()
-            return [dict(row) for row in rows]
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
         finally:
             conn.close()
 
     def count(self) -> int:
-        conn = self._conn()
-        try:
-            cur = conn.cursor()
+        total = 0
+        for shard in range(len(self.shard_paths)):
+            cur = self._conn(shard).cursor()
             cur.execute('SELECT COUNT(*) as c FROM processed')
-            c = cur.fetchone()['c']
-            return c
-        finally:
-            conn.close()
+            total += cur.fetchone()['c']
+        return total
 
     def topics(self) -> List[str]:
-        conn = self._conn()
-        try:
-            cur = conn.cursor()
-            cur.execute('SELECT DISTINCT topic FROM processed')
-            rows = cur.fetchall()
-            return [r['topic'] for r in rows]
-        finally:
-            conn.close()
\ No newline at end of file
+        if self.shared:
+            for shard in range(len(self.shard_paths)):
+                cur = self._conn(shard).execute('SELECT DISTINCT topic FROM processed')
+                self._topics.update(r['topic'] for r in cur)
+        return sorted(self._topics)
\ No newline at end of file
@@ -1,100 +1,175 @@
 import os
 import asyncio
-import json
 import logging
-from fastapi import FastAPI, HTTPException, Query
+import msgspec
+import orjson
+from datetime import datetime, tzinfo
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi import BackgroundTasks
-from fastapi.responses import JSONResponse
-from typing import List, Optional, Union
+from fastapi.openapi.utils import get_openapi
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from typing import Dict, List, Optional, Tuple, Union
 from .models import Event
 from .dedup_store import DedupStore
-from .consumer import Consumer
 from .stats import Stats
+from .write_buffer import WriteBuffer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('aggregator')
 
 DB_PATH = os.environ.get('DEDUP_DB', './data.db')
+DB_SHARDS = int(os.environ.get('DEDUP_SHARDS', '1'))
+BLOOM_PATH = os.environ.get('DEDUP_BLOOM_PATH')
+BLOOM_CAPACITY = int(os.environ.get('DEDUP_BLOOM_CAPACITY', '1000000'))
+BLOOM_ERROR_RATE = float(os.environ.get('DEDUP_BLOOM_ERROR_RATE', '1e-6'))
+WRITE_BUFFER_ROWS = int(os.environ.get('WRITE_BUFFER_ROWS', '500'))
+WRITE_BUFFER_DELAY = float(os.environ.get('WRITE_BUFFER_DELAY', '0.05'))
+INGEST_CONCURRENCY = int(os.environ.get('INGEST_CONCURRENCY', '8'))
+WORKERS = int(os.environ.get('WEB_CONCURRENCY', '1'))
+OFFLOAD_DECODE_BYTES = 256 * 1024
 
-dedup = DedupStore(DB_PATH)
+# Without the shared Bloom file each worker buffers writes and checks only its own pending rows,
+# so concurrent duplicates across workers would be acked as new.
+if WORKERS > 1 and BLOOM_PATH is None:
+    raise RuntimeError('WEB_CONCURRENCY>1 requires DEDUP_BLOOM_PATH to be set')
+
+EventBatch = Union[List[Event], Event]
+(PUBLISH_SCHEMA,), SCHEMA_COMPONENTS = msgspec.json.schema_components([EventBatch], ref_template='#/components/schemas/{name}')
+EVENT_DECODER = msgspec.json.Decoder(EventBatch)
+EVENT_FIELDS = ('topic', 'event_id', 'timestamp', 'source', 'payload')
+
+dedup = DedupStore(
+    DB_PATH,
+    shards=DB_SHARDS,
+    bloom_capacity=BLOOM_CAPACITY,
+    bloom_error_rate=BLOOM_ERROR_RATE,
+    bloom_path=BLOOM_PATH
+)
 stats = Stats()
-queue: asyncio.Queue = asyncio.Queue()
-consumer = Consumer(queue, dedup, stats)
+buffer = WriteBuffer(dedup, max_rows=WRITE_BUFFER_ROWS, max_delay=WRITE_BUFFER_DELAY)
+ingest_sem = asyncio.Semaphore(INGEST_CONCURRENCY)
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 @app.on_event('startup')
 async def startup():
-    app.state.consumer_task = asyncio.create_task(consumer.run())
-    app.state.start_time = stats.start_time
+    app.state.flusher_task = asyncio.create_task(buffer.run())
 
 @app.on_event('shutdown')
 async def shutdown():
-    consumer.stop()
-    task = app.state.consumer_task
+    await buffer.stop()
+    task = app.state.flusher_task
     task.cancel()
     try:
         await task
-    except Exception:
+    except asyncio.CancelledError:
         pass
 
-@app.post('/publish')
-async def publish(events: Union[Event, List[Event]]):
+@app.post('/publish', openapi_extra={
+    'requestBody': {'required': True, 'content': {'application/json': {'schema': PUBLISH_SCHEMA}}}
+})
+async def publish(request: Request):
+    # Bounds how many request bodies and decoded batches are held in memory at once.
+    async with ingest_sem:
+        return await _ingest(request)
+
+async def _ingest(request: Request):
+    body = await request.body()
+    try:
+        if len(body) > OFFLOAD_DECODE_BYTES:
+            events = await asyncio.to_thread(EVENT_DECODER.decode, body)
+        else:
+            events = EVENT_DECODER.decode(body)
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
     evs = events if isinstance(events, list) else [events]
     enqueued = 0
     duplicates_rejected = 0
+    failed = 0
+    rows = []
+    iso: Dict[Tuple[datetime, Optional[tzinfo]], str] = {}
     
     for ev in evs:
+        # Aware datetimes compare equal across offsets, so tzinfo is part of the key.
+        ts_key = (ev.timestamp, ev.timestamp.tzinfo)
+        timestamp = iso.get(ts_key)
+        if timestamp is None:
+            timestamp = iso[ts_key] = ev.timestamp.isoformat()
+
         try:
-            stats.received += 1
-
-            topic = ev.topic
-            event_id = ev.event_id
-
-            if isinstance(ev.timestamp, str):
-                timestamp = ev.timestamp
-            elif hasattr(ev.timestamp, 'isoformat'):
-                timestamp = ev.timestamp.isoformat()
-            else:
-                timestamp = str(ev.timestamp)
-            
-            source = ev.source
-
-            try:
-                payload_json = json.dumps(ev.payload, separators=(',', ':'))
-            except (TypeError, ValueError) as e:
-                logger.error(f'Failed to serialize payload for event {event_id}: {e}')
-                stats.duplicate_dropped += 1 
-                continue
-
-            inserted = dedup.add_if_new(topic, event_id, timestamp, source, payload_json)
-            
-            if not inserted:
-                stats.duplicate_dropped += 1
-                duplicates_rejected += 1
-                logger.info(f'Duplicate rejected at ingestion: topic={topic} event_id={event_id}')
-                continue
-
-            await queue.put(ev.dict())
-            enqueued += 1
-            
-        except Exception as e:
-            logger.error(f'Error processing event {ev.event_id if hasattr(ev, "event_id") else "unknown"}: {e}')
-            stats.duplicate_dropped += 1 
+            payload_json = orjson.dumps(ev.payload).decode()
+        except TypeError as e:
+            logger.error(f'Failed to serialize payload for event {ev.event_id}: {e}')
+            failed += 1
+            continue
+
+        rows.append((ev.topic, ev.event_id, timestamp, ev.source, payload_json))
+
+    inserted = await buffer.accept(rows) if rows else []
+
+    for (topic, event_id, *_), is_new in zip(rows, inserted):
+        if not is_new:
+            duplicates_rejected += 1
+            logger.info(f'Duplicate rejected at ingestion: topic={topic} event_id={event_id}')
             continue
+
+        enqueued += 1
+
+    stats.inc_received(len(evs))
+    stats.inc_unique(enqueued)
+    stats.inc_duplicate(duplicates_rejected + failed)
+    stats.notify()
     
-    return JSONResponse({
+    return ORJSONResponse({
         'enqueued': enqueued,
         'duplicates_rejected': duplicates_rejected
     })
 
+async def flush_buffer():
+    unwritten = await buffer.flush()
+    if unwritten:
+        raise HTTPException(status_code=503, detail=f'{unwritten} accepted events are not yet written to the store')
+
+def _encode_events(chunks):
+    yield b'{"events":['
+    sep = b''
+    for rows in chunks:
+        yield sep + b','.join(orjson.dumps(dict(zip(EVENT_FIELDS, row))) for row in rows)
+        sep = b','
+    yield b']}'
+
 @app.get('/events')
 async def get_events(topic: Optional[str] = Query(None)):
-    items = dedup.list_by_topic(topic)
-    return JSONResponse({'events': items})
+    await flush_buffer()
+    return StreamingResponse(_encode_events(dedup.iter_by_topic(topic)), media_type='application/json')
 
 @app.get('/stats')
 async def get_stats():
-    data = stats.to_dict()
-    data['topics'] = dedup.topics()
-    return JSONResponse(data)
\ No newline at end of file
+    return ORJSONResponse(stats.to_dict())
+
+@app.get('/topics')
+async def get_topics():
+    await flush_buffer()
+    return ORJSONResponse({'topics': await buffer.topics()})
+
+@app.get('/stats/wait')
+async def wait_stats(received: int = Query(..., ge=0), timeout: float = Query(30.0, gt=0, le=60)):
+    await stats.wait_until(received, timeout)
+    return ORJSONResponse(stats.to_dict())
+
+@app.get('/drain')
+async def drain():
+    # The flush queues behind every accept already on the writer thread.
+    await flush_buffer()
+    return ORJSONResponse(stats.to_dict())
+
+def custom_openapi():
+    # /publish reads the raw body, so the Event schema comes from msgspec rather than FastAPI.
+    if app.openapi_schema is None:
+        schema = get_openapi(title=app.title, version=app.version, routes=app.routes)
+        schema.setdefault('components', {}).setdefault('schemas', {}).update(SCHEMA_COMPONENTS)
+        app.openapi_schema = schema
+    return app.openapi_schema
+
+app.openapi = custom_openapi
\ No newline at end of file
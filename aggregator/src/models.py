@@ -1,16 +1,15 @@
-from pydantic import BaseModel, Field, validator
+import msgspec
 from datetime import datetime
 from typing import Any, Dict
 
-class Event(BaseModel):
-    topic: str = Field(...)
-    event_id: str = Field(...)
-    timestamp: datetime = Field(...)
-    source: str = Field(...)
-    payload: Dict[str, Any] = Field(default_factory=dict)
+class Event(msgspec.Struct, gc=False):
+    topic: str
+    event_id: str
+    timestamp: datetime
+    source: str
+    payload: Dict[str, Any] = msgspec.field(default_factory=dict)
 
-    @validator('topic', 'event_id', 'source')
-    def not_empty(cls, v):
-        if not v or not str(v).strip():
-            raise ValueError('must not be empty')
-        return v
\ No newline at end of file
+    def __post_init__(self):
+        for name in ('topic', 'event_id', 'source'):
+            if not getattr(self, name).strip():
+                raise ValueError(f'{name} must not be empty')
\ No newline at end of file
@@ -1,4 +1,6 @@
+import asyncio
 import time
+from asyncio import Event
 from dataclasses import dataclass, field
 from typing import Dict
 
@@ -8,6 +10,36 @@ class Stats:
     unique_processed: int = 0
     duplicate_dropped: int = 0
     start_time: float = field(default_factory=time.time)
+    _progress: Event = field(default_factory=Event, repr=False, compare=False)
+
+    def inc_received(self, n: int = 1):
+        self.received += n
+
+    def inc_unique(self, n: int = 1):
+        self.unique_processed += n
+
+    def inc_duplicate(self, n: int = 1):
+        self.duplicate_dropped += n
+
+    def notify(self):
+        # Waiters hold the old event; swapping avoids clear() racing with them.
+        self._progress.set()
+        self._progress = Event()
+
+    def settled(self, received: int) -> bool:
+        return self.received >= received and self.received == self.unique_processed + self.duplicate_dropped
+
+    async def wait_until(self, received: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while not self.settled(received):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._progress.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
 
     def uptime(self):
         return time.time() - self.start_time
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set, Tuple
+from .dedup_store import DedupStore
+
+logger = logging.getLogger('aggregator.write_buffer')
+
+class WriteBuffer:
+    def __init__(self, dedup: DedupStore, max_rows: int = 500, max_delay: float = 0.05):
+        self.dedup = dedup
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._rows: List[Tuple] = []
+        self._pending: Set[Tuple[str, str]] = set()
+        self._stop = False
+        # All store access goes through this one thread, which keeps SQLite off the
+        # event loop and serializes _rows/_pending without a lock.
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dedup-writer')
+
+    @property
+    def enabled(self) -> bool:
+        # Other workers cannot see rows held here, so a shared store is written straight through.
+        return self.max_rows > 0 and not self.dedup.shared
+
+    def _submit(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self._writer, fn, *args)
+
+    async def accept(self, rows: List[Tuple]) -> List[bool]:
+        return await self._submit(self._accept, rows)
+
+    async def flush(self) -> int:
+        return await self._submit(self._flush)
+
+    async def topics(self) -> List[str]:
+        return await self._submit(self.dedup.topics)
+
+    def _accept(self, rows: List[Tuple]) -> List[bool]:
+        if not self.enabled:
+            return self.dedup.add_many(rows)
+
+        accepted = [False] * len(rows)
+        firsts: Dict[Tuple[str, str], int] = {}
+        for i, row in enumerate(rows):
+            key = (row[0], row[1])
+            if key not in self._pending:
+                firsts.setdefault(key, i)
+
+        candidates = list(firsts.values())
+        for i, found in zip(candidates, self.dedup.exists_many([rows[i] for i in candidates])):
+            if not found:
+                accepted[i] = True
+                self._rows.append(rows[i])
+                self._pending.add((rows[i][0], rows[i][1]))
+
+        if len(self._rows) >= self.max_rows:
+            self._flush()
+        return accepted
+
+    def _flush(self) -> int:
+        if not self._rows:
+            return 0
+        rows = self._rows
+        try:
+            written = self.dedup.add_many(rows)
+            failed = [row for row, ok in zip(rows, written) if not ok]
+            if failed:
+                # add_many() reports every row of a failed shard as not new, so drop the ones that landed.
+                failed = [row for row, found in zip(failed, self.dedup.exists_many(failed)) if not found]
+        except sqlite3.Error as e:
+            logger.error(f'Write buffer flush failed, {len(rows)} events kept for retry: {e}')
+            return len(rows)
+
+        self._rows = failed
+        self._pending = {(row[0], row[1]) for row in failed}
+        if failed:
+            logger.error(f'{len(failed)} buffered events were not written, kept for retry')
+        return len(failed)
+
+    async def run(self):
+        logger.info('Write buffer flusher started')
+        while not self._stop:
+            await asyncio.sleep(self.max_delay)
+            if self._rows:
+                await self.flush()
+
+    async def stop(self):
+        self._stop = True
+        unwritten = await self.flush()
+        if unwritten:
+            logger.error(f'{unwritten} buffered events lost on shutdown')
+        self._writer.shutdown()
\ No newline at end of file
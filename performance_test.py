@@ -1,9 +1,12 @@
 import requests
 import time
 import json
+import random
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from typing import List, Dict
+from requests.adapters import HTTPAdapter
 
 GREEN = '\033[92m'
 YELLOW = '\033[93m'
@@ -14,11 +17,11 @@ RESET = '\033[0m'
 
 BASE_URL = "http://localhost:8080"
 
-def create_event(event_id: int, topic: str = "perf-test") -> Dict:
+def create_event(event_id: int, topic: str = "perf-test", timestamp: str = None) -> Dict:
     return {
         "topic": topic,
         "event_id": f"evt-{event_id}",
-        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "timestamp": timestamp or datetime.utcnow().isoformat() + "Z",
         "source": "performance-test",
         "payload": {
             "index": event_id,
@@ -28,46 +31,56 @@ def create_event(event_id: int, topic: str = "perf-test") -> Dict:
 
 def generate_events(total: int, dup_rate: float) -> List[Dict]:
     unique_count = int(total * (1 - dup_rate))
-    events = []
     
     print(f"{BLUE}Generating {total} events ({unique_count} unique, {total - unique_count} duplicates)...{RESET}")
 
-    for i in range(unique_count):
-        events.append(create_event(i))
+    timestamp = datetime.utcnow().isoformat() + "Z"
+    unique = [create_event(i, timestamp=timestamp) for i in range(unique_count)]
 
-    for i in range(total - unique_count):
-        idx = i % unique_count
-        events.append(create_event(idx)) 
-    
-    return events
+    return unique + random.choices(unique, k=total - unique_count)
+
+def create_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
-def send_batch(events: List[Dict], batch_size: int = 1000) -> Dict:
+def send_batch(events: List[Dict], batch_size: int = 1000, concurrency: int = 8) -> Dict:
     total_events = len(events)
     batches = [events[i:i + batch_size] for i in range(0, total_events, batch_size)]
+    bodies = [(len(batch), json.dumps(batch).encode()) for batch in batches]
     
-    print(f"{BLUE}Sending {total_events} events in {len(batches)} batches of {batch_size}...{RESET}")
+    print(f"{BLUE}Sending {total_events} events in {len(batches)} batches of {batch_size} ({concurrency} concurrent)...{RESET}")
     
     start_time = time.time()
     sent_count = 0
-    
-    for idx, batch in enumerate(batches, 1):
-        batch_start = time.time()
-        
-        try:
-            response = requests.post(
+
+    with create_session(concurrency) as session, ThreadPoolExecutor(max_workers=concurrency) as pool:
+
+        def post(count: int, body: bytes):
+            batch_start = time.time()
+            response = session.post(
                 f"{BASE_URL}/publish",
-                json=batch,
+                data=body,
+                headers={"Content-Type": "application/json"},
                 timeout=30
             )
             response.raise_for_status()
-            sent_count += len(batch)
-            
-            batch_elapsed = time.time() - batch_start
-            print(f"  Batch {idx}/{len(batches)}: {len(batch)} events in {batch_elapsed:.2f}s", end='\r')
-            
-        except requests.exceptions.RequestException as e:
-            print(f"{RED}Error sending batch {idx}: {e}{RESET}")
-            return None
+            return count, time.time() - batch_start
+
+        futures = {pool.submit(post, count, body): idx for idx, (count, body) in enumerate(bodies, 1)}
+
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                count, batch_elapsed = future.result()
+            except requests.exceptions.RequestException as e:
+                print(f"{RED}Error sending batch {idx}: {e}{RESET}")
+                return None
+
+            sent_count += count
+            print(f"  Batch {idx}/{len(batches)}: {count} events in {batch_elapsed:.2f}s", end='\r')
     
     print()
     total_elapsed = time.time() - start_time
@@ -78,42 +91,38 @@ def send_batch(events: List[Dict], batch_size: int = 1000) -> Dict:
         "throughput": sent_count / total_elapsed
     }
 
-def wait_for_processing(timeout: int = 60) -> bool:
+def wait_for_processing(expected: int, timeout: int = 60) -> bool:
     print(f"{BLUE}Waiting for processing to complete (timeout: {timeout}s)...{RESET}")
-    
-    start_time = time.time()
-    last_stats = None
-    
-    while time.time() - start_time < timeout:
-        try:
-            response = requests.get(f"{BASE_URL}/stats", timeout=5)
-            stats = response.json()
-            
-            received = stats.get('received', 0)
-            processed = stats.get('unique_processed', 0)
-            dropped = stats.get('duplicate_dropped', 0)
-
-            if received == processed + dropped:
-                print(f"{GREEN}✓ All events processed!{RESET}")
-                return True
-
-            if stats != last_stats:
-                print(f"  Progress: received={received}, processed={processed}, dropped={dropped}", end='\r')
-                last_stats = stats
-            
-            time.sleep(0.1)
-            
-        except requests.exceptions.RequestException as e:
-            print(f"{RED}Error checking stats: {e}{RESET}")
-            time.sleep(1)
-    
+
+    try:
+        response = requests.get(
+            f"{BASE_URL}/stats/wait",
+            params={"received": expected, "timeout": timeout},
+            timeout=timeout + 5
+        )
+        response.raise_for_status()
+        stats = response.json()
+    except requests.exceptions.RequestException as e:
+        print(f"{RED}Error checking stats: {e}{RESET}")
+        return False
+
+    received = stats.get('received', 0)
+    processed = stats.get('unique_processed', 0)
+    dropped = stats.get('duplicate_dropped', 0)
+
+    if received >= expected and received == processed + dropped:
+        print(f"{GREEN}✓ All events processed!{RESET}")
+        return True
+
+    print(f"  Progress: received={received}, processed={processed}, dropped={dropped}")
     print(f"{RED}✗ Timeout waiting for processing{RESET}")
     return False
 
 def get_final_stats() -> Dict:
     try:
-        response = requests.get(f"{BASE_URL}/stats", timeout=5)
-        return response.json()
+        stats = requests.get(f"{BASE_URL}/stats", timeout=5).json()
+        stats['topics'] = requests.get(f"{BASE_URL}/topics", timeout=5).json()['topics']
+        return stats
     except requests.exceptions.RequestException as e:
         print(f"{RED}Error getting stats: {e}{RESET}")
         return None
@@ -178,6 +187,7 @@ def main():
     parser.add_argument('--events', type=int, default=5000, help='Total number of events (default: 5000)')
     parser.add_argument('--dup-rate', type=float, default=0.2, help='Duplication rate 0.0-1.0 (default: 0.2)')
     parser.add_argument('--batch-size', type=int, default=1000, help='Batch size (default: 1000)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent requests (default: 8)')
     parser.add_argument('--url', type=str, default='http://localhost:8080', help='Server URL')
     
     args = parser.parse_args()
@@ -190,6 +200,7 @@ def main():
     print(f"  Total events:      {args.events}")
     print(f"  Duplication rate:  {args.dup_rate * 100:.0f}%")
     print(f"  Batch size:        {args.batch_size}")
+    print(f"  Concurrency:       {args.concurrency}")
     print(f"  Server URL:        {BASE_URL}\n")
 
     if not check_server_ready():
@@ -204,11 +215,11 @@ def main():
 
     events = generate_events(args.events, args.dup_rate)
 
-    send_metrics = send_batch(events, args.batch_size)
+    send_metrics = send_batch(events, args.batch_size, args.concurrency)
     if not send_metrics:
         return 1
 
-    if not wait_for_processing(timeout=60):
+    if not wait_for_processing(send_metrics['sent_count'], timeout=60):
         return 1
 
     stats = get_final_stats()
@@ -1,8 +1,10 @@
 import os
 import time
 import random
+import orjson
 import requests
 import logging
+from requests.adapters import HTTPAdapter
 from datetime import datetime
 from typing import List, Dict
 
@@ -18,11 +20,15 @@ TOTAL_EVENTS = int(os.environ.get('TOTAL_EVENTS', '1000'))
 DUPLICATE_RATE = float(os.environ.get('DUPLICATE_RATE', '0.2'))
 INTERVAL = float(os.environ.get('INTERVAL', '5.0'))
 
-def create_event(event_id: int, topic: str = "demo") -> Dict:
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
+def create_event(event_id: int, topic: str = "demo", timestamp: str = None) -> Dict:
     return {
         "topic": topic,
         "event_id": f"evt-{event_id}",
-        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "timestamp": timestamp or datetime.utcnow().isoformat() + "Z",
         "source": "publisher-service",
         "payload": {
             "index": event_id,
@@ -34,16 +40,12 @@ def create_event(event_id: int, topic: str = "demo") -> Dict:
 def generate_events_with_duplicates(total: int, dup_rate: float) -> List[Dict]:
     unique_count = int(total * (1 - dup_rate))
     duplicate_count = total - unique_count
-    events = []
     
     logger.info(f"Generating {total} events ({unique_count} unique, {duplicate_count} duplicates)")
     
-    for i in range(unique_count):
-        events.append(create_event(i))
-    
-    for _ in range(duplicate_count):
-        random_idx = random.randint(0, unique_count - 1)
-        events.append(create_event(random_idx))
+    timestamp = datetime.utcnow().isoformat() + "Z"
+    unique = [create_event(i, timestamp=timestamp) for i in range(unique_count)]
+    events = unique + random.choices(unique, k=duplicate_count)
     
     random.shuffle(events)
     
@@ -51,9 +53,10 @@ def generate_events_with_duplicates(total: int, dup_rate: float) -> List[Dict]:
 
 def send_batch(events: List[Dict]) -> bool:
     try:
-        response = requests.post(
+        response = session.post(
             f"{AGGREGATOR_URL}/publish",
-            json=events,
+            data=orjson.dumps(events),
+            headers={"Content-Type": "application/json"},
             timeout=10
         )
         response.raise_for_status()
@@ -66,7 +69,7 @@ def send_batch(events: List[Dict]) -> bool:
 
 def check_aggregator_health() -> bool:
     try:
-        response = requests.get(f"{AGGREGATOR_URL}/stats", timeout=5)
+        response = session.get(f"{AGGREGATOR_URL}/stats", timeout=5)
         response.raise_for_status()
         stats = response.json()
         logger.info(f"Aggregator stats: {stats}")
@@ -2,7 +2,6 @@ import os, sys
 import tempfile
 import time
 import json
-import asyncio
 import pytest
 from fastapi.testclient import TestClient
 
@@ -24,11 +23,7 @@ def client(tmp_path, monkeypatch):
     os.environ['DEDUP_DB'] = str(dbfile)
     appmod.dedup = DedupStore(str(dbfile))
     appmod.stats = appmod.stats.__class__()
-    appmod.queue = asyncio.Queue()
-    appmod.consumer = appmod.consumer.__class__(appmod.queue, appmod.dedup, appmod.stats)
-
-    import threading
-    threading.Thread(target=lambda: asyncio.run(appmod.consumer.run()), daemon=True).start()
+    appmod.buffer = appmod.buffer.__class__(appmod.dedup)
 
     client = TestClient(appmod.app)
     yield client
@@ -43,20 +38,19 @@ def make_event(i, topic='t1'):
         'payload': {'i': i}
     }
 
-def drain_queue_and_wait(client, timeout=5.0):
-    start = time.time()
-    while time.time() - start < timeout:
-        r = client.get('/stats')
-        data = r.json()
-        if data['received'] == data['unique_processed'] + data['duplicate_dropped']:
-            return data
-        time.sleep(0.05)
-    return data
+def drain_queue_and_wait(client):
+    return client.get('/drain').json()
 
 def test_schema_validation(client):
     r = client.post('/publish', json={'topic': 't', 'event_id': 'e'})
     assert r.status_code == 422
 
+def test_publish_schema_documented(client):
+    spec = client.get('/openapi.json').json()
+    body = spec['paths']['/publish']['post']['requestBody']
+    assert 'anyOf' in body['content']['application/json']['schema']
+    assert 'event_id' in spec['components']['schemas']['Event']['required']
+
 def test_dedup_persistence(tmp_path):
     db_path = str(tmp_path / 'test.db')
 
@@ -70,6 +64,58 @@ def test_dedup_persistence(tmp_path):
 
     assert store2.count() == 1
 
+def test_add_many_batch(tmp_path):
+    store = DedupStore(str(tmp_path / 'test.db'))
+    store.add_if_new('t1', 'id-0', '2025-01-01', 'test', '{}')
+
+    rows = [('t1', f'id-{i}', '2025-01-01', 'test', '{}') for i in (0, 1, 2, 1)]
+    assert store.add_many(rows) == [False, True, True, False]
+    assert store.count() == 3
+
+    store.add_many([('t2', 'id-0', '2025-01-01', 'test', '{}')])
+    assert store.topics() == ['t1', 't2']
+    assert DedupStore(str(tmp_path / 'test.db')).topics() == ['t1', 't2']
+
+def test_shared_bloom_file(tmp_path):
+    db_path = str(tmp_path / 'test.db')
+    bloom_path = str(tmp_path / 'bloom.bin')
+    worker1 = DedupStore(db_path, bloom_path=bloom_path)
+    worker2 = DedupStore(db_path, bloom_path=bloom_path)
+
+    assert worker1.add_many([('t1', 'id-1', '2025-01-01', 'test', '{}')]) == [True]
+    assert worker2._bloom.maybe_contains('t1\0id-1')
+    assert worker2.add_many([('t1', 'id-1', '2025-01-01', 'test', '{}')]) == [False]
+    assert worker2.topics() == ['t1']
+
+def test_sharded_store(tmp_path):
+    db_path = str(tmp_path / 'test.db')
+    store = DedupStore(db_path, shards=4)
+    rows = [(f't{i % 5}', f'id-{i}', f'2025-01-0{i % 9 + 1}', 'test', '{}') for i in range(50)]
+    assert all(store.add_many(rows))
+    assert (tmp_path / 'test.0.db').exists()
+
+    reopened = DedupStore(db_path, shards=4)
+    assert reopened.add_many(rows[:3]) == [False, False, False]
+    assert reopened.count() == 50
+    assert reopened.topics() == ['t0', 't1', 't2', 't3', 't4']
+
+    listed = [row for chunk in reopened.iter_by_topic(chunk_size=7) for row in chunk]
+    assert [(r[0], r[2]) for r in listed] == sorted((r[0], r[2]) for r in rows)
+    assert len([row for chunk in reopened.iter_by_topic('t3') for row in chunk]) == 10
+
+def test_reshard_refused(tmp_path):
+    unsharded = str(tmp_path / 'one.db')
+    DedupStore(unsharded).add_many([('t1', 'id-1', '2025-01-01', 'test', '{}')])
+    with pytest.raises(ValueError):
+        DedupStore(unsharded, shards=4)
+
+    sharded = str(tmp_path / 'four.db')
+    DedupStore(sharded, shards=4)
+    with pytest.raises(ValueError):
+        DedupStore(sharded, shards=2)
+    with pytest.raises(ValueError):
+        DedupStore(sharded)
+
 def test_dedup_detection(client):
     ev = make_event(2)
     client.post('/publish', json=ev)
@@ -79,6 +125,63 @@ def test_dedup_detection(client):
     assert stats['unique_processed'] == 1
     assert stats['duplicate_dropped'] == 1
 
+def test_stats_wait(client):
+    client.post('/publish', json=[make_event(i, 'wait') for i in range(3)] + [make_event(0, 'wait')])
+
+    r = client.get('/stats/wait', params={'received': 4, 'timeout': 5})
+    data = r.json()
+    assert data['received'] == 4
+    assert data['unique_processed'] == 3
+    assert data['duplicate_dropped'] == 1
+
+    start = time.time()
+    r = client.get('/stats/wait', params={'received': 5, 'timeout': 0.2})
+    assert r.json()['received'] == 4
+    assert time.time() - start < 5.0
+
+def test_unserializable_payload_counted_as_dropped(client):
+    bad = dict(make_event(1, 'bad'), payload={'n': 2 ** 70})
+    r = client.post('/publish', json=[bad, make_event(2, 'bad')])
+    assert r.json() == {'enqueued': 1, 'duplicates_rejected': 0}
+
+    stats = client.get('/stats').json()
+    assert stats['received'] == 2
+    assert stats['duplicate_dropped'] == 1
+
+def test_timestamp_offset_preserved(client):
+    a = dict(make_event(1, 'tz'), timestamp='2024-01-01T07:00:00+07:00')
+    b = dict(make_event(2, 'tz'), timestamp='2024-01-01T00:00:00+00:00')
+    client.post('/publish', json=[a, b])
+
+    events = client.get('/events?topic=tz').json()['events']
+    assert sorted(e['timestamp'] for e in events) == ['2024-01-01T00:00:00+00:00', '2024-01-01T07:00:00+07:00']
+
+def test_write_buffer_rejects_pending_duplicates(client):
+    r = client.post('/publish', json=[make_event(1, 'buf'), make_event(2, 'buf')])
+    assert r.json() == {'enqueued': 2, 'duplicates_rejected': 0}
+    assert appmod.dedup.count() == 0
+
+    r = client.post('/publish', json=make_event(1, 'buf'))
+    assert r.json() == {'enqueued': 0, 'duplicates_rejected': 1}
+
+    assert client.get('/topics').json() == {'topics': ['buf']}
+
+    client.get('/drain')
+    assert appmod.dedup.count() == 2
+
+def test_write_buffer_keeps_rows_when_flush_fails(client):
+    client.post('/publish', json=[make_event(i, 'retry') for i in range(3)])
+    conn = appmod.dedup._conn()
+    conn.execute('ALTER TABLE processed RENAME TO processed_off')
+
+    assert client.get('/drain').status_code == 503
+    assert client.get('/events').status_code == 503
+
+    conn.execute('ALTER TABLE processed_off RENAME TO processed')
+    stats = client.get('/drain').json()
+    assert stats['unique_processed'] == 3
+    assert appmod.dedup.count() == 3
+
 def test_get_events_by_topic(client):
     client.post('/publish', json=make_event(100, 'topic-a'))
     client.post('/publish', json=make_event(101, 'topic-a'))
@@ -95,6 +198,9 @@ def test_get_events_by_topic(client):
     data = r.json()
     assert len(data['events']) == 1
     assert data['events'][0]['topic'] == 'topic-b'
+
+    assert 'topics' not in client.get('/stats').json()
+    assert client.get('/topics').json() == {'topics': ['topic-a', 'topic-b']}
     
 def test_get_events_and_stats_consistency(client):
     events = [make_event(i) for i in range(3, 8)]
@@ -116,7 +222,7 @@ def test_stress_batch(client):
         events.append(make_event(idx, topic='stress'))
     start = time.time()
     client.post('/publish', json=events)
-    stats = drain_queue_and_wait(client, timeout=30.0)
+    stats = drain_queue_and_wait(client)
     elapsed = time.time() - start
     assert stats['received'] == total
     assert stats['unique_processed'] == unique